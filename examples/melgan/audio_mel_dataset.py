@@ -14,6 +14,8 @@
 # limitations under the License.
 """Dataset modules."""
 
+import abc
+import glob
 import logging
 import os
 
@@ -24,7 +26,93 @@ from tensorflow_tts.datasets.abstract_dataset import AbstractDataset
 from tensorflow_tts.utils import find_files
 
 
-class AudioMelDataset(AbstractDataset):
+class BaseAudioMelDataset(AbstractDataset):
+    """Base Tensorflow Audio Mel dataset, batches features from _load_dataset."""
+
+    @abc.abstractmethod
+    def _load_dataset(self, num_parallel_reads):
+        """Return dataset of loaded audio and mel features."""
+        pass
+
+    def get_args(self):
+        raise NotImplementedError("Features are loaded by _load_dataset.")
+
+    def generator(self):
+        raise NotImplementedError("Features are loaded by _load_dataset.")
+
+    def get_output_dtypes(self):
+        raise NotImplementedError("Features are loaded by _load_dataset.")
+
+    def create(
+        self,
+        allow_cache=False,
+        batch_size=1,
+        is_shuffle=False,
+        map_fn=None,
+        reshuffle_each_iteration=True,
+        cache_filename="",
+        num_parallel_reads=tf.data.experimental.AUTOTUNE,
+    ):
+        """Create tf.dataset function.
+
+        Loaded features are cached before shuffle and map_fn so random cropping
+        still happens every epoch. Cache is kept in memory if cache_filename is
+        empty, otherwise it is written to cache_filename on disk. Features are
+        loaded by num_parallel_reads concurrent calls.
+        """
+        datasets = self._load_dataset(num_parallel_reads)
+
+        datasets = datasets.filter(
+            lambda x: x["mel_lengths"] > self.mel_length_threshold
+        )
+        datasets = datasets.filter(
+            lambda x: x["audio_lengths"] > self.audio_length_threshold
+        )
+
+        if allow_cache:
+            datasets = datasets.cache(cache_filename)
+
+        if is_shuffle:
+            datasets = datasets.shuffle(
+                self.get_len_dataset(),
+                reshuffle_each_iteration=reshuffle_each_iteration,
+            )
+
+        if batch_size > 1 and map_fn is None:
+            raise ValueError("map function must define when batch_size > 1.")
+
+        if map_fn is not None:
+            datasets = datasets.map(map_fn, tf.data.experimental.AUTOTUNE)
+
+        # define padded shapes
+        padded_shapes = {
+            "utt_ids": [],
+            "audios": [None],
+            "mels": [None, 80],
+            "mel_lengths": [],
+            "audio_lengths": [],
+        }
+
+        # define padded values
+        padding_values = {
+            "utt_ids": "",
+            "audios": 0.0,
+            "mels": 0.0,
+            "mel_lengths": 0,
+            "audio_lengths": 0,
+        }
+
+        datasets = datasets.padded_batch(
+            batch_size,
+            padded_shapes=padded_shapes,
+            padding_values=padding_values,
+            drop_remainder=True,
+        )
+        datasets = datasets.prefetch(tf.data.experimental.AUTOTUNE)
+        return datasets
+
+
+class AudioMelDataset(BaseAudioMelDataset):
     """Tensorflow Audio Mel dataset."""
 
     def __init__(
@@ -73,22 +161,6 @@ class AudioMelDataset(AbstractDataset):
         self.audio_length_threshold = audio_length_threshold
         self.mel_length_threshold = mel_length_threshold
 
-    def get_args(self):
-        return [self.utt_ids]
-
-    def generator(self, utt_ids):
-        for i, utt_id in enumerate(utt_ids):
-            audio_file = self.audio_files[i]
-            mel_file = self.mel_files[i]
-
-            items = {
-                "utt_ids": utt_id,
-                "audio_files": audio_file,
-                "mel_files": mel_file,
-            }
-
-            yield items
-
     @tf.function
     def _load_data(self, items):
         audio = tf.numpy_function(np.load, [items["audio_files"]], tf.float32)
@@ -104,84 +176,156 @@ class AudioMelDataset(AbstractDataset):
 
         return items
 
-    def create(
-        self,
-        allow_cache=False,
-        batch_size=1,
-        is_shuffle=False,
-        map_fn=None,
-        reshuffle_each_iteration=True,
-    ):
-        """Create tf.dataset function."""
-        output_types = self.get_output_dtypes()
-        datasets = tf.data.Dataset.from_generator(
-            self.generator, output_types=output_types, args=(self.get_args())
+    def _load_dataset(self, num_parallel_reads):
+        """Return dataset of loaded audio and mel features."""
+        datasets = tf.data.Dataset.from_tensor_slices(
+            {
+                "utt_ids": self.utt_ids,
+                "audio_files": self.audio_files,
+                "mel_files": self.mel_files,
+            }
         )
 
         # load dataset
         datasets = datasets.map(
-            lambda items: self._load_data(items), tf.data.experimental.AUTOTUNE
+            lambda items: self._load_data(items), num_parallel_reads
         )
+        return datasets
 
-        datasets = datasets.filter(
-            lambda x: x["mel_lengths"] > self.mel_length_threshold
-        )
-        datasets = datasets.filter(
-            lambda x: x["audio_lengths"] > self.audio_length_threshold
-        )
+    def to_tfrecord(self, output_dir, prefix="audio-mel", num_shards=1):
+        """Write dataset to TFRecord shards with int16 audio and float16 mels.
 
-        if allow_cache:
-            datasets = datasets.cache()
+        Utterances are written round-robin to {prefix}-{i}-of-{N}.tfrecords and
+        the number of utterances is saved to {prefix}.count next to them.
 
-        if is_shuffle:
-            datasets = datasets.shuffle(
-                self.get_len_dataset(),
-                reshuffle_each_iteration=reshuffle_each_iteration,
+        Args:
+            output_dir (str): Directory to write TFRecord shards in.
+            prefix (str): Prefix of TFRecord shards, e.g. to tell raw and
+                normalized mels apart.
+            num_shards (int): Number of TFRecord shards to write.
+
+        """
+        # remove shards of an earlier conversion, shard count may differ.
+        old_files = glob.glob(os.path.join(output_dir, _tfrecord_query(prefix)))
+        for old_file in old_files:
+            os.remove(old_file)
+
+        num_shards = max(1, min(num_shards, len(self.utt_ids)))
+        writers = [
+            tf.io.TFRecordWriter(
+                os.path.join(
+                    output_dir, f"{prefix}-{i:05d}-of-{num_shards:05d}.tfrecords"
+                )
             )
+            for i in range(num_shards)
+        ]
+        for i, (utt_id, audio_file, mel_file) in enumerate(
+            zip(self.utt_ids, self.audio_files, self.mel_files)
+        ):
+            audio = self.audio_load_fn(audio_file)
+            mel = self.mel_load_fn(mel_file)
+            audio = np.round(np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+            mel = mel.astype(np.float16)
+            feature = {
+                "utt_ids": _bytes_feature(utt_id.encode()),
+                "audios": _bytes_feature(audio.tobytes()),
+                "mels": _bytes_feature(mel.tobytes()),
+            }
+            example = tf.train.Example(features=tf.train.Features(feature=feature))
+            writers[i % num_shards].write(example.SerializeToString())
+        for writer in writers:
+            writer.close()
 
-        if batch_size > 1 and map_fn is None:
-            raise ValueError("map function must define when batch_size > 1.")
+        with open(os.path.join(output_dir, f"{prefix}.count"), "w") as f:
+            f.write(str(len(self.utt_ids)))
 
-        if map_fn is not None:
-            datasets = datasets.map(map_fn, tf.data.experimental.AUTOTUNE)
+    def get_len_dataset(self):
+        return len(self.utt_ids)
 
-        # define padded shapes
-        padded_shapes = {
-            "utt_ids": [],
-            "audios": [None],
-            "mels": [None, 80],
-            "mel_lengths": [],
-            "audio_lengths": [],
-        }
+    def __name__(self):
+        return "AudioMelDataset"
 
-        # define padded values
-        padding_values = {
-            "utt_ids": "",
-            "audios": 0.0,
-            "mels": 0.0,
-            "mel_lengths": 0,
-            "audio_lengths": 0,
-        }
 
-        datasets = datasets.padded_batch(
-            batch_size,
-            padded_shapes=padded_shapes,
-            padding_values=padding_values,
-            drop_remainder=True,
+class AudioMelTFRecordDataset(BaseAudioMelDataset):
+    """Tensorflow Audio Mel dataset read from TFRecord shards."""
+
+    def __init__(
+        self,
+        root_dir,
+        prefix="audio-mel",
+        num_mels=80,
+        audio_length_threshold=0,
+        mel_length_threshold=0,
+    ):
+        """Initialize dataset.
+
+        Args:
+            root_dir (str): Root directory including TFRecord shards and
+                {prefix}.count written by AudioMelDataset.to_tfrecord.
+            prefix (str): Prefix of TFRecord shards to read in root_dir.
+            num_mels (int): Number of mel bins stored in TFRecord shards.
+            audio_length_threshold (int): Threshold to remove short audio files.
+            mel_length_threshold (int): Threshold to remove short feature files.
+
+        """
+        tfrecord_files = sorted(find_files(root_dir, _tfrecord_query(prefix)))
+        assert (
+            len(tfrecord_files) != 0
+        ), f"Not found any tfrecord files in ${root_dir}."
+
+        with open(os.path.join(root_dir, f"{prefix}.count")) as f:
+            num_examples = int(f.read())
+
+        # set global params
+        self.tfrecord_files = tfrecord_files
+        self.num_examples = num_examples
+        self.num_mels = num_mels
+        self.audio_length_threshold = audio_length_threshold
+        self.mel_length_threshold = mel_length_threshold
+
+    def _parse_example(self, example):
+        features = tf.io.parse_single_example(
+            example,
+            {
+                "utt_ids": tf.io.FixedLenFeature([], tf.string),
+                "audios": tf.io.FixedLenFeature([], tf.string),
+                "mels": tf.io.FixedLenFeature([], tf.string),
+            },
         )
-        datasets = datasets.prefetch(tf.data.experimental.AUTOTUNE)
-        return datasets
+        audio = tf.cast(tf.io.decode_raw(features["audios"], tf.int16), tf.float32)
+        audio = audio / 32767.0
+        mel = tf.cast(tf.io.decode_raw(features["mels"], tf.float16), tf.float32)
+        mel = tf.reshape(mel, [-1, self.num_mels])
 
-    def get_output_dtypes(self):
-        output_types = {
-            "utt_ids": tf.string,
-            "audio_files": tf.string,
-            "mel_files": tf.string,
+        items = {
+            "utt_ids": features["utt_ids"],
+            "audios": audio,
+            "mels": mel,
+            "mel_lengths": tf.shape(mel)[0],
+            "audio_lengths": tf.shape(audio)[0],
         }
-        return output_types
+
+        return items
+
+    def _load_dataset(self, num_parallel_reads):
+        """Return dataset of parsed audio and mel features."""
+        datasets = tf.data.TFRecordDataset(
+            self.tfrecord_files, num_parallel_reads=num_parallel_reads
+        )
+        datasets = datasets.map(self._parse_example, num_parallel_reads)
+        return datasets
 
     def get_len_dataset(self):
-        return len(self.utt_ids)
+        return self.num_examples
 
     def __name__(self):
-        return "AudioMelDataset"
+        return "AudioMelTFRecordDataset"
+
+
+def _bytes_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _tfrecord_query(prefix):
+    # digits after the prefix keep "audio-mel" from matching "audio-mel-norm".
+    return f"{prefix}-[0-9]*-of-[0-9]*.tfrecords"
@@ -25,6 +25,9 @@ import sys
 sys.path.append(".")
 
 import argparse
+import concurrent.futures
+import functools
+import hashlib
 import logging
 import os
 
@@ -35,7 +38,10 @@ from tqdm import tqdm
 
 import tensorflow_tts
 import tensorflow_tts.configs.melgan as MELGAN_CONFIG
-from examples.melgan.audio_mel_dataset import AudioMelDataset
+from examples.melgan.audio_mel_dataset import (
+    AudioMelDataset,
+    AudioMelTFRecordDataset,
+)
 from tensorflow_tts.losses import TFMelSpectrogram
 from tensorflow_tts.models import TFMelGANGenerator, TFMelGANMultiScaleDiscriminator
 from tensorflow_tts.trainers import GanBasedTrainer
@@ -88,6 +94,15 @@ class MelganTrainer(GanBasedTrainer):
         self.reset_states_eval()
 
         self.config = config
+        self._discriminator_outputs = None
+        self._fm_layers_per_scale = None
+        self._predict_generator = None
+        self._lambda_feat_match = tf.constant(
+            config["lambda_feat_match"], dtype=tf.float32
+        )
+        # thread pool to plot and write intermediate results off the eval loop.
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self._io_futures = []
 
     def compile(self, gen_model, dis_model, gen_optimizer, dis_optimizer):
         super().compile(gen_model, dis_model, gen_optimizer, dis_optimizer)
@@ -98,7 +113,90 @@ class MelganTrainer(GanBasedTrainer):
         self.mae_loss = tf.keras.losses.MeanAbsoluteError(
             reduction=tf.keras.losses.Reduction.NONE
         )
-        self.mels_loss = TFMelSpectrogram()
+        # keep spectrogram loss in float32 under mixed precision policy.
+        self.mels_loss = TFMelSpectrogram(dtype=tf.float32)
+
+    def set_predict_gen_model(self, predict_generator):
+        """Set float16 copy of generator used to generate intermediate results."""
+        self._predict_generator = predict_generator
+        with self._strategy.scope():
+            # switched off when float16 outputs are not finite.
+            self._use_predict_generator = tf.Variable(True, trainable=False)
+
+    @tf.function
+    def _sync_predict_generator(self):
+        """Copy generator weights to its float16 copy on device."""
+        for v, v16 in zip(self._generator.weights, self._predict_generator.weights):
+            v16.assign(tf.cast(v, v16.dtype))
+
+    def _one_step_predict_per_replica(self, batch):
+        if self._predict_generator is None:
+            return super()._one_step_predict_per_replica(batch)
+        return tf.cond(
+            self._use_predict_generator,
+            lambda: self._predict_generator(**batch, training=False),
+            lambda: self._generator(**batch, training=False),
+        )
+
+    def _discriminator_forward(self, audios, y_hat):
+        """Run discriminator on groundtruth and generated audio.
+
+        Outputs are cached on the (audios, y_hat) tensors so generator and
+        discriminator losses of the same step share one forward pass. They are
+        cast to float32 so losses are computed in float32 under mixed precision.
+
+        Args:
+            audios: groundtruth audio, shape [B, T]
+            y_hat: generated audio, shape [B, T, 1]
+
+        Returns:
+            p: discriminator outputs of groundtruth audio.
+            p_hat: discriminator outputs of generated audio.
+        """
+        key = (audios.ref(), y_hat.ref())
+        cached = self._discriminator_outputs
+        if cached is None or cached[0] != key:
+            p = self._discriminator(tf.expand_dims(audios, 2))
+            p_hat = self._discriminator(y_hat)
+            p, p_hat = tf.nest.map_structure(
+                lambda x: tf.cast(x, tf.float32), (p, p_hat)
+            )
+            self._discriminator_outputs = (key, p, p_hat)
+        return self._discriminator_outputs[1:]
+
+    def _reset_step_caches(self):
+        """Drop trace-time tensors cached for one step once the step is built."""
+        self._discriminator_outputs = None
+
+    def _calculate_gradients_per_batch(self, batch):
+        try:
+            return super()._calculate_gradients_per_batch(batch)
+        finally:
+            self._reset_step_caches()
+
+    def _one_step_forward_per_replica(self, batch):
+        try:
+            return super()._one_step_forward_per_replica(batch)
+        finally:
+            self._reset_step_caches()
+
+    def _one_step_evaluate_per_replica(self, batch):
+        try:
+            return super()._one_step_evaluate_per_replica(batch)
+        finally:
+            self._reset_step_caches()
+
+    def _get_discriminator_output_counts(self, p_hat):
+        """Return number of scales and feature-matching layers of each scale.
+
+        Both are fixed by the discriminator, so they are counted on the first
+        outputs and reused afterwards. Scales may have different depths, the
+        feature-matching loss keeps the original normalisation by the number
+        of scales times the layers of the last scale.
+        """
+        if self._fm_layers_per_scale is None:
+            self._fm_layers_per_scale = [len(x) - 1 for x in p_hat]
+        return len(self._fm_layers_per_scale), self._fm_layers_per_scale
 
     def compute_per_example_generator_losses(self, batch, outputs):
         """Compute per example generator losses and return dict_metrics_losses
@@ -116,24 +214,26 @@ class MelganTrainer(GanBasedTrainer):
         audios = batch["audios"]
         y_hat = outputs
 
-        p_hat = self._discriminator(y_hat)
-        p = self._discriminator(tf.expand_dims(audios, 2))
-        adv_loss = 0.0
-        for i in range(len(p_hat)):
-            adv_loss += calculate_3d_loss(
-                tf.ones_like(p_hat[i][-1]), p_hat[i][-1], loss_fn=self.mse_loss
-            )
-        adv_loss /= i + 1
+        p, p_hat = self._discriminator_forward(audios, y_hat)
+        num_scales, fm_layers_per_scale = self._get_discriminator_output_counts(p_hat)
+        adv_loss = tf.add_n(
+            [
+                calculate_3d_loss(
+                    tf.ones_like(p_hat[i][-1]), p_hat[i][-1], loss_fn=self.mse_loss
+                )
+                for i in range(num_scales)
+            ]
+        ) / num_scales
 
         # define feature-matching loss
-        fm_loss = 0.0
-        for i in range(len(p_hat)):
-            for j in range(len(p_hat[i]) - 1):
-                fm_loss += calculate_3d_loss(
-                    p[i][j], p_hat[i][j], loss_fn=self.mae_loss
-                )
-        fm_loss /= (i + 1) * (j + 1)
-        adv_loss += self.config["lambda_feat_match"] * fm_loss
+        fm_loss = tf.add_n(
+            [
+                calculate_3d_loss(p[i][j], p_hat[i][j], loss_fn=self.mae_loss)
+                for i in range(num_scales)
+                for j in range(fm_layers_per_scale[i])
+            ]
+        ) / (num_scales * fm_layers_per_scale[-1])
+        adv_loss += self._lambda_feat_match * fm_loss
 
         per_example_losses = adv_loss
 
@@ -152,21 +252,25 @@ class MelganTrainer(GanBasedTrainer):
         audios = batch["audios"]
         y_hat = gen_outputs
 
-        y = tf.expand_dims(audios, 2)
-        p = self._discriminator(y)
-        p_hat = self._discriminator(y_hat)
+        p, p_hat = self._discriminator_forward(audios, y_hat)
+        num_scales, _ = self._get_discriminator_output_counts(p_hat)
 
-        real_loss = 0.0
-        fake_loss = 0.0
-        for i in range(len(p)):
-            real_loss += calculate_3d_loss(
-                tf.ones_like(p[i][-1]), p[i][-1], loss_fn=self.mse_loss
-            )
-            fake_loss += calculate_3d_loss(
-                tf.zeros_like(p_hat[i][-1]), p_hat[i][-1], loss_fn=self.mse_loss
-            )
-        real_loss /= i + 1
-        fake_loss /= i + 1
+        real_loss = tf.add_n(
+            [
+                calculate_3d_loss(
+                    tf.ones_like(p[i][-1]), p[i][-1], loss_fn=self.mse_loss
+                )
+                for i in range(num_scales)
+            ]
+        ) / num_scales
+        fake_loss = tf.add_n(
+            [
+                calculate_3d_loss(
+                    tf.zeros_like(p_hat[i][-1]), p_hat[i][-1], loss_fn=self.mse_loss
+                )
+                for i in range(num_scales)
+            ]
+        ) / num_scales
         dis_loss = real_loss + fake_loss
 
         # calculate per_example_losses and dict_metrics_losses
@@ -182,24 +286,35 @@ class MelganTrainer(GanBasedTrainer):
 
     def generate_and_save_intermediate_result(self, batch):
         """Generate and save intermediate result."""
-        import matplotlib.pyplot as plt
-
         # generate
         y_batch_ = self.one_step_predict(batch)
+        if self._predict_generator is not None and self._use_predict_generator:
+            if not all(
+                tf.reduce_all(tf.math.is_finite(y_))
+                for y_ in self._strategy.experimental_local_results(y_batch_)
+            ):
+                logging.warning(
+                    f"(Steps: {self.steps}) float16 generator output is not finite, "
+                    "use float32 generator to generate intermediate results."
+                )
+                self._use_predict_generator.assign(False)
+                y_batch_ = self.one_step_predict(batch)
         y_batch = batch["audios"]
         utt_ids = batch["utt_ids"]
 
         # convert to tensor.
         # here we just take a sample at first replica.
         try:
-            y_batch_ = y_batch_.values[0].numpy()
-            y_batch = y_batch.values[0].numpy()
+            y_batch_ = y_batch_.values[0]
+            y_batch = y_batch.values[0]
             utt_ids = utt_ids.values[0].numpy()
         except Exception:
-            y_batch_ = y_batch_.numpy()
-            y_batch = y_batch.numpy()
             utt_ids = utt_ids.numpy()
 
+        # clip on device before copying to host.
+        y_batch_ = tf.clip_by_value(y_batch_, -1.0, 1.0).numpy()
+        y_batch = tf.clip_by_value(y_batch, -1.0, 1.0).numpy()
+
         # check directory
         dirname = os.path.join(self.config["outdir"], f"predictions/{self.steps}steps")
         if not os.path.exists(dirname):
@@ -207,36 +322,61 @@ class MelganTrainer(GanBasedTrainer):
 
         for idx, (y, y_) in enumerate(zip(y_batch, y_batch_), 0):
             # convert to ndarray
-            y, y_ = tf.reshape(y, [-1]).numpy(), tf.reshape(y_, [-1]).numpy()
+            y, y_ = np.reshape(y, [-1]), np.reshape(y_, [-1])
 
-            # plit figure and save it
+            # plot and write on the io pool so evaluation is not blocked.
             utt_id = utt_ids[idx]
             figname = os.path.join(dirname, f"{utt_id}.png")
-            plt.subplot(2, 1, 1)
-            plt.plot(y)
-            plt.title("groundtruth speech")
-            plt.subplot(2, 1, 2)
-            plt.plot(y_)
-            plt.title(f"generated speech @ {self.steps} steps")
-            plt.tight_layout()
-            plt.savefig(figname)
-            plt.close()
-
-            # save as wavefile
-            y = np.clip(y, -1, 1)
-            y_ = np.clip(y_, -1, 1)
-            sf.write(
-                figname.replace(".png", "_ref.wav"),
+            future = self._io_pool.submit(
+                _save_intermediate_result,
                 y,
-                self.config["sampling_rate"],
-                "PCM_16",
-            )
-            sf.write(
-                figname.replace(".png", "_gen.wav"),
                 y_,
+                figname,
+                self.steps,
                 self.config["sampling_rate"],
-                "PCM_16",
             )
+            self._io_futures.append(future)
+
+    def _eval_epoch(self):
+        """Evaluate model one epoch and wait for intermediate results."""
+        if self._predict_generator is not None and self._use_predict_generator:
+            self._sync_predict_generator()
+
+        super()._eval_epoch()
+
+        # re-raise any error raised while saving intermediate results.
+        io_futures, self._io_futures = self._io_futures, []
+        for future in io_futures:
+            future.result()
+
+    def run(self):
+        """Run training and wait for pending intermediate results."""
+        try:
+            super().run()
+        finally:
+            self._io_pool.shutdown(wait=True)
+
+
+def _save_intermediate_result(y, y_, figname, steps, sampling_rate):
+    """Plot groundtruth/generated audio and save them as wavefiles."""
+    from matplotlib.figure import Figure
+
+    # plot figure and save it, use Figure directly since pyplot is not thread-safe.
+    fig = Figure()
+    ax = fig.add_subplot(2, 1, 1)
+    ax.plot(y)
+    ax.set_title("groundtruth speech")
+    ax = fig.add_subplot(2, 1, 2)
+    ax.plot(y_)
+    ax.set_title(f"generated speech @ {steps} steps")
+    fig.tight_layout()
+    fig.savefig(figname)
+
+    # save as wavefile, convert to int16 so soundfile writes samples as is.
+    y = np.round(y * 32767.0).astype(np.int16)
+    y_ = np.round(y_ * 32767.0).astype(np.int16)
+    sf.write(figname.replace(".png", "_ref.wav"), y, sampling_rate, "PCM_16")
+    sf.write(figname.replace(".png", "_gen.wav"), y_, sampling_rate, "PCM_16")
 
 
 def collater(
@@ -257,29 +397,38 @@ def collater(
         batch_max_steps = (tf.shape(audio)[0] // hop_size) * hop_size
 
     batch_max_frames = batch_max_steps // hop_size
-    if len(audio) < len(mel) * hop_size:
-        audio = tf.pad(audio, [[0, len(mel) * hop_size - len(audio)]])
+    mel_length = tf.shape(mel)[0]
 
-    if len(mel) > batch_max_frames:
+    # make sure audio covers all mel frames.
+    audio = tf.pad(
+        audio, [[0, tf.maximum(0, mel_length * hop_size - tf.shape(audio)[0])]]
+    )
+
+    def _random_crop():
         # randomly pickup with the batch_max_steps length of the part
-        interval_start = 0
-        interval_end = len(mel) - batch_max_frames
         start_frame = tf.random.uniform(
-            shape=[], minval=interval_start, maxval=interval_end, dtype=tf.int32
+            shape=[], minval=0, maxval=mel_length - batch_max_frames, dtype=tf.int32
         )
         start_step = start_frame * hop_size
-        audio = audio[start_step : start_step + batch_max_steps]
-        mel = mel[start_frame : start_frame + batch_max_frames, :]
-    else:
-        audio = tf.pad(audio, [[0, batch_max_steps - len(audio)]])
-        mel = tf.pad(mel, [[0, batch_max_frames - len(mel)], [0, 0]])
+        return (
+            audio[start_step : start_step + batch_max_steps],
+            mel[start_frame : start_frame + batch_max_frames, :],
+        )
+
+    def _pad():
+        return (
+            tf.pad(audio, [[0, batch_max_steps - tf.shape(audio)[0]]]),
+            tf.pad(mel, [[0, batch_max_frames - mel_length], [0, 0]]),
+        )
+
+    audio, mel = tf.cond(mel_length > batch_max_frames, _random_crop, _pad)
 
     items = {
         "utt_ids": items["utt_ids"],
         "audios": audio,
         "mels": mel,
-        "mel_lengths": len(mel),
-        "audio_lengths": len(audio),
+        "mel_lengths": tf.shape(mel)[0],
+        "audio_lengths": tf.shape(audio)[0],
     }
 
     return items
@@ -336,6 +485,12 @@ def main():
         type=int,
         help="using mixed precision for discriminator or not.",
     )
+    parser.add_argument(
+        "--convert-tfrecords",
+        default=0,
+        type=int,
+        help="convert npy train/dev data to tfrecord before training or not.",
+    )
     parser.add_argument(
         "--pretrained",
         default="",
@@ -348,14 +503,11 @@ def main():
     # return strategy
     STRATEGY = return_strategy()
 
-    # set mixed precision config
-    if args.generator_mixed_precision == 1 or args.discriminator_mixed_precision == 1:
-        tf.config.optimizer.set_experimental_options({"auto_mixed_precision": True})
-
     args.generator_mixed_precision = bool(args.generator_mixed_precision)
     args.discriminator_mixed_precision = bool(args.discriminator_mixed_precision)
 
     args.use_norm = bool(args.use_norm)
+    args.convert_tfrecords = bool(args.convert_tfrecords)
 
     # set logger
     if args.verbose > 1:
@@ -406,53 +558,105 @@ def main():
     else:
         mel_length_threshold = None
 
+    # raw and normalized mels are written to differently named shards.
+    tfrecord_prefix = "audio-mel-norm" if args.use_norm else "audio-mel-raw"
+
     if config["format"] == "npy":
-        audio_query = "*-wave.npy"
-        mel_query = "*-raw-feats.npy" if args.use_norm is False else "*-norm-feats.npy"
-        audio_load_fn = np.load
-        mel_load_fn = np.load
+        dataset_cls = AudioMelDataset
+        dataset_params = {
+            "audio_query": "*-wave.npy",
+            "mel_query": "*-raw-feats.npy"
+            if args.use_norm is False
+            else "*-norm-feats.npy",
+            "audio_load_fn": np.load,
+            "mel_load_fn": np.load,
+        }
+    elif config["format"] == "tfrecord":
+        dataset_cls = AudioMelTFRecordDataset
+        dataset_params = {"prefix": tfrecord_prefix}
+    else:
+        raise ValueError("Only npy and tfrecord are supported.")
+
+    # convert npy data to tfrecord with int16 audio and float16 mels.
+    if args.convert_tfrecords:
+        if config["format"] != "npy":
+            raise ValueError("Only npy can be converted to tfrecord.")
+        for root_dir in [args.train_dir, args.dev_dir]:
+            AudioMelDataset(root_dir=root_dir, **dataset_params).to_tfrecord(
+                root_dir,
+                prefix=tfrecord_prefix,
+                num_shards=config.get("num_tfrecord_shards", 16),
+            )
+            logging.info(f"Successfully converted {root_dir} to tfrecord.")
+        dataset_cls = AudioMelTFRecordDataset
+        dataset_params = {"prefix": tfrecord_prefix}
+
+    # cache loaded features in memory or on disk. Disk cache files are named
+    # after format, mel type and data directory so a changed setup never reads
+    # stale features, changed files in the same directory need a cleared cache.
+    cache_dataset = config.get("cache_dataset", "memory")
+    if not config["allow_cache"] or cache_dataset == "memory":
+        train_cache_filename, valid_cache_filename = "", ""
     else:
-        raise ValueError("Only npy are supported.")
+        os.makedirs(cache_dataset, exist_ok=True)
+        cache_prefix = "-".join(
+            [
+                "tfrecord" if args.convert_tfrecords else config["format"],
+                "norm" if args.use_norm else "raw",
+            ]
+        )
+        train_cache_filename, valid_cache_filename = [
+            os.path.join(
+                cache_dataset,
+                f"{split}-{cache_prefix}-"
+                + hashlib.md5(os.path.abspath(root_dir).encode()).hexdigest(),
+            )
+            for split, root_dir in [("train", args.train_dir), ("valid", args.dev_dir)]
+        ]
+
+    # number of files loaded concurrently, autotuned if not set.
+    num_parallel_reads = config.get(
+        "num_parallel_reads", tf.data.experimental.AUTOTUNE
+    )
 
     # define train/valid dataset
-    train_dataset = AudioMelDataset(
+    train_dataset = dataset_cls(
         root_dir=args.train_dir,
-        audio_query=audio_query,
-        mel_query=mel_query,
-        audio_load_fn=audio_load_fn,
-        mel_load_fn=mel_load_fn,
         mel_length_threshold=mel_length_threshold,
+        **dataset_params,
     ).create(
         is_shuffle=config["is_shuffle"],
-        map_fn=lambda items: collater(
-            items,
+        map_fn=functools.partial(
+            collater,
             batch_max_steps=tf.constant(config["batch_max_steps"], dtype=tf.int32),
             hop_size=tf.constant(config["hop_size"], dtype=tf.int32),
         ),
         allow_cache=config["allow_cache"],
+        cache_filename=train_cache_filename,
+        num_parallel_reads=num_parallel_reads,
         batch_size=config["batch_size"]
         * STRATEGY.num_replicas_in_sync
         * config["gradient_accumulation_steps"],
     )
 
-    valid_dataset = AudioMelDataset(
+    valid_dataset = dataset_cls(
         root_dir=args.dev_dir,
-        audio_query=audio_query,
-        mel_query=mel_query,
-        audio_load_fn=audio_load_fn,
-        mel_load_fn=mel_load_fn,
         mel_length_threshold=mel_length_threshold,
+        **dataset_params,
     ).create(
         is_shuffle=config["is_shuffle"],
-        map_fn=lambda items: collater(
-            items,
+        map_fn=functools.partial(
+            collater,
             batch_max_steps=tf.constant(
                 config["batch_max_steps_valid"], dtype=tf.int32
             ),
             hop_size=tf.constant(config["hop_size"], dtype=tf.int32),
         ),
         allow_cache=config["allow_cache"],
-        batch_size=config["batch_size"] * STRATEGY.num_replicas_in_sync,
+        cache_filename=valid_cache_filename,
+        num_parallel_reads=num_parallel_reads,
+        batch_size=config.get("eval_batch_size", config["batch_size"])
+        * STRATEGY.num_replicas_in_sync,
     )
 
     # define trainer
@@ -467,17 +671,26 @@ def main():
 
     # define generator and discriminator
     with STRATEGY.scope():
+        # each model is built under its own policy, mixed_float16 models compute
+        # in float16 with float32 variables. Loss scaling is done by the trainer.
+        tf.keras.mixed_precision.experimental.set_policy(
+            "mixed_float16" if args.generator_mixed_precision else "float32"
+        )
         generator = TFMelGANGenerator(
             MELGAN_CONFIG.MelGANGeneratorConfig(**config["melgan_generator_params"]),
             name="melgan_generator",
         )
 
+        tf.keras.mixed_precision.experimental.set_policy(
+            "mixed_float16" if args.discriminator_mixed_precision else "float32"
+        )
         discriminator = TFMelGANMultiScaleDiscriminator(
             MELGAN_CONFIG.MelGANDiscriminatorConfig(
                 **config["melgan_discriminator_params"]
             ),
             name="melgan_discriminator",
         )
+        tf.keras.mixed_precision.experimental.set_policy("float32")
 
         # dummy input to build model.
         fake_mels = tf.random.uniform(shape=[1, 100, 80], dtype=tf.float32)
@@ -493,6 +706,20 @@ def main():
         generator.summary()
         discriminator.summary()
 
+        # float16 copy of generator to generate intermediate results.
+        predict_generator = None
+        if config.get("fp16_predict", False):
+            policy = tf.keras.mixed_precision.experimental.global_policy()
+            tf.keras.mixed_precision.experimental.set_policy("float16")
+            predict_generator = TFMelGANGenerator(
+                MELGAN_CONFIG.MelGANGeneratorConfig(
+                    **config["melgan_generator_params"]
+                ),
+                name="melgan_generator_float16",
+            )
+            tf.keras.mixed_precision.experimental.set_policy(policy)
+            predict_generator(fake_mels)
+
         gen_optimizer = tf.keras.optimizers.Adam(**config["generator_optimizer_params"])
         dis_optimizer = tf.keras.optimizers.Adam(
             **config["discriminator_optimizer_params"]
@@ -504,6 +731,8 @@ def main():
         gen_optimizer=gen_optimizer,
         dis_optimizer=dis_optimizer,
     )
+    if predict_generator is not None:
+        trainer.set_predict_gen_model(predict_generator)
 
     # start training
     try:
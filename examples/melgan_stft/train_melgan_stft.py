@@ -123,24 +123,31 @@ class MultiSTFTMelganTrainer(MelganTrainer):
         gen_loss = 0.5 * (sc_loss + mag_loss)
 
         if self.steps >= self.config["discriminator_train_start_steps"]:
-            p_hat = self._discriminator(y_hat)
-            p = self._discriminator(tf.expand_dims(audios, 2))
-            adv_loss = 0.0
-            for i in range(len(p_hat)):
-                adv_loss += calculate_3d_loss(
-                    tf.ones_like(p_hat[i][-1]), p_hat[i][-1], loss_fn=self.mse_loss
-                )
-            adv_loss /= i + 1
+            p, p_hat = self._discriminator_forward(audios, y_hat)
+            (
+                num_scales,
+                fm_layers_per_scale,
+            ) = self._get_discriminator_output_counts(p_hat)
+            adv_loss = tf.add_n(
+                [
+                    calculate_3d_loss(
+                        tf.ones_like(p_hat[i][-1]),
+                        p_hat[i][-1],
+                        loss_fn=self.mse_loss,
+                    )
+                    for i in range(num_scales)
+                ]
+            ) / num_scales
 
             # define feature-matching loss
-            fm_loss = 0.0
-            for i in range(len(p_hat)):
-                for j in range(len(p_hat[i]) - 1):
-                    fm_loss += calculate_3d_loss(
-                        p[i][j], p_hat[i][j], loss_fn=self.mae_loss
-                    )
-            fm_loss /= (i + 1) * (j + 1)
-            adv_loss += self.config["lambda_feat_match"] * fm_loss
+            fm_loss = tf.add_n(
+                [
+                    calculate_3d_loss(p[i][j], p_hat[i][j], loss_fn=self.mae_loss)
+                    for i in range(num_scales)
+                    for j in range(fm_layers_per_scale[i])
+                ]
+            ) / (num_scales * fm_layers_per_scale[-1])
+            adv_loss += self._lambda_feat_match * fm_loss
             gen_loss += self.config["lambda_adv"] * adv_loss
 
             dict_metrics_losses.update({"adversarial_loss": adv_loss})
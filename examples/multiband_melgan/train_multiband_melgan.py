@@ -97,6 +97,8 @@ class MultiBandMelganTrainer(MelganTrainer):
         self.reset_states_train()
         self.reset_states_eval()
 
+        self._synthesis_outputs = None
+
     def compile(self, gen_model, dis_model, gen_optimizer, dis_optimizer, pqmf):
         super().compile(gen_model, dis_model, gen_optimizer, dis_optimizer)
         # define loss
@@ -110,6 +112,21 @@ class MultiBandMelganTrainer(MelganTrainer):
         # define pqmf module
         self.pqmf = pqmf
 
+    def _synthesis(self, y_mb_hat):
+        """Synthesis full-band audio from sub-band outputs.
+
+        The result is cached on y_mb_hat so generator and discriminator losses
+        of the same step feed the same y_hat tensor to the discriminator.
+        """
+        cached = self._synthesis_outputs
+        if cached is None or cached[0] != y_mb_hat.ref():
+            self._synthesis_outputs = (y_mb_hat.ref(), self.pqmf.synthesis(y_mb_hat))
+        return self._synthesis_outputs[1]
+
+    def _reset_step_caches(self):
+        super()._reset_step_caches()
+        self._synthesis_outputs = None
+
     def compute_per_example_generator_losses(self, batch, outputs):
         """Compute per example generator losses and return dict_metrics_losses
         Note that all element of the loss MUST has a shape [batch_size] and 
@@ -128,7 +145,7 @@ class MultiBandMelganTrainer(MelganTrainer):
 
         audios = batch["audios"]
         y_mb_hat = outputs
-        y_hat = self.pqmf.synthesis(y_mb_hat)
+        y_hat = self._synthesis(y_mb_hat)
 
         y_mb = self.pqmf.analysis(tf.expand_dims(audios, -1))
         y_mb = tf.transpose(y_mb, (0, 2, 1))  # [B, subbands, T//subbands]
@@ -159,14 +176,18 @@ class MultiBandMelganTrainer(MelganTrainer):
         )
 
         if self.steps >= self.config["discriminator_train_start_steps"]:
-            p_hat = self._discriminator(y_hat)
-            p = self._discriminator(tf.expand_dims(audios, 2))
-            adv_loss = 0.0
-            for i in range(len(p_hat)):
-                adv_loss += calculate_3d_loss(
-                    tf.ones_like(p_hat[i][-1]), p_hat[i][-1], loss_fn=self.mse_loss
-                )
-            adv_loss /= i + 1
+            p, p_hat = self._discriminator_forward(audios, y_hat)
+            num_scales, _ = self._get_discriminator_output_counts(p_hat)
+            adv_loss = tf.add_n(
+                [
+                    calculate_3d_loss(
+                        tf.ones_like(p_hat[i][-1]),
+                        p_hat[i][-1],
+                        loss_fn=self.mse_loss,
+                    )
+                    for i in range(num_scales)
+                ]
+            ) / num_scales
             gen_loss += self.config["lambda_adv"] * adv_loss
 
             dict_metrics_losses.update({"adversarial_loss": adv_loss},)
@@ -194,7 +215,7 @@ class MultiBandMelganTrainer(MelganTrainer):
             dict_metrics_losses: dictionary loss.
         """
         y_mb_hat = gen_outputs
-        y_hat = self.pqmf.synthesis(y_mb_hat)
+        y_hat = self._synthesis(y_mb_hat)
         (
             per_example_losses,
             dict_metrics_losses,
@@ -109,7 +109,7 @@ class Tacotron2Trainer(Seq2SeqBasedTrainer):
 
         # update counts
         self.steps += 1
-        self.tqdm.update(1)
+        self._update_tqdm()
         self._check_train_finish()
 
     def _one_step_evaluate_per_replica(self, batch):
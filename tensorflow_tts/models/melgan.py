@@ -281,7 +281,7 @@ class TFMelGANGenerator(tf.keras.Model):
         Returns:
             Tensor: Output tensor (B, T ** prod(upsample_scales), out_channels)
         """
-        return self.inference(mels)
+        return self.melgan(mels)
 
     @tf.function(
         input_signature=[
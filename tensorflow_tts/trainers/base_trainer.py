@@ -39,6 +39,9 @@ class BasedTrainer(metaclass=abc.ABCMeta):
         self.train_metrics = None
         self.eval_metrics = None
         self.list_metrics_name = None
+        # update progress bar every tqdm_update_steps steps only.
+        self._tqdm_update_steps = max(1, config.get("log_interval_steps", 10) // 10)
+        self._tqdm_accum = 0
 
     def init_train_eval_metrics(self, list_metrics_name):
         """Init train and eval metrics to save it to tensorboard."""
@@ -106,9 +109,21 @@ class BasedTrainer(metaclass=abc.ABCMeta):
             if self.finish_train:
                 break
 
+        self._flush_tqdm()
         self.tqdm.close()
         logging.info("Finish training.")
 
+    def _update_tqdm(self):
+        """Accumulate one step and update progress bar every few steps."""
+        self._tqdm_accum += 1
+        if self._tqdm_accum >= self._tqdm_update_steps:
+            self._flush_tqdm()
+
+    def _flush_tqdm(self):
+        """Update progress bar with accumulated steps."""
+        self.tqdm.update(self._tqdm_accum)
+        self._tqdm_accum = 0
+
     @abc.abstractmethod
     def save_checkpoint(self):
         """Save checkpoint."""
@@ -181,7 +196,7 @@ class BasedTrainer(metaclass=abc.ABCMeta):
         with self.writer.as_default():
             for key, value in list_metrics.items():
                 tf.summary.scalar(stage + "/" + key, value.result(), step=self.steps)
-                self.writer.flush()
+        self.writer.flush()
 
 
 class GanBasedTrainer(BasedTrainer):
@@ -227,6 +242,17 @@ class GanBasedTrainer(BasedTrainer):
     def _get_eval_element_signature(self):
         return self.eval_data_loader.element_spec
 
+    def _get_per_replica_signature(self, element_spec):
+        """Return signature of per-replica batch without string features.
+
+        Batch dimension is relaxed since each replica gets a part of global batch.
+        """
+        return {
+            k: tf.TensorSpec([None] + spec.shape[1:].as_list(), spec.dtype)
+            for k, spec in element_spec.items()
+            if spec.dtype != tf.string
+        }
+
     def set_gen_model(self, generator_model):
         """Set generator class model (MUST)."""
         self._generator = generator_model
@@ -273,7 +299,7 @@ class GanBasedTrainer(BasedTrainer):
         self.set_gen_optimizer(gen_optimizer)
         self.set_dis_optimizer(dis_optimizer)
 
-    def _train_step(self, batch):
+    def _apply_input_signature(self):
         if self._already_apply_input_signature is False:
             train_element_signature = self._get_train_element_signature()
             eval_element_signature = self._get_eval_element_signature()
@@ -286,14 +312,47 @@ class GanBasedTrainer(BasedTrainer):
             self.one_step_predict = tf.function(
                 self._one_step_predict, input_signature=[eval_element_signature]
             )
+            # compile per-replica computation with XLA, optimizer updates
+            # stay outside since they need cross-replica communication.
+            self.calculate_gradients_per_batch = self._calculate_gradients_per_batch
+            self.one_step_evaluate_per_replica = self._one_step_evaluate_per_replica
+            self.one_step_predict_per_replica = self._one_step_predict_per_replica
+            if self.config.get("use_xla", False):
+                train_per_replica_signature = self._get_per_replica_signature(
+                    self._train_element_spec
+                )
+                eval_per_replica_signature = self._get_per_replica_signature(
+                    self._eval_element_spec
+                )
+                self.calculate_gradients_per_batch = tf.function(
+                    self._calculate_gradients_per_batch,
+                    input_signature=[train_per_replica_signature],
+                    experimental_compile=True,
+                )
+                self.one_step_evaluate_per_replica = tf.function(
+                    self._one_step_evaluate_per_replica,
+                    input_signature=[eval_per_replica_signature],
+                    experimental_compile=True,
+                )
+                self.one_step_predict_per_replica = tf.function(
+                    self._one_step_predict_per_replica,
+                    input_signature=[eval_per_replica_signature],
+                    experimental_compile=True,
+                )
+            # n is always passed as an int32 scalar tensor, iterators of the
+            # same dataset share one type spec, so this traces only once.
+            self.train_n_steps = tf.function(self._train_n_steps)
             self._already_apply_input_signature = True
 
+    def _train_step(self, batch):
+        self._apply_input_signature()
+
         # run one_step_forward
         self.one_step_forward(batch)
 
         # update counts
         self.steps += 1
-        self.tqdm.update(1)
+        self._update_tqdm()
         self._check_train_finish()
 
     def _one_step_forward(self, batch):
@@ -304,6 +363,79 @@ class GanBasedTrainer(BasedTrainer):
             tf.distribute.ReduceOp.SUM, per_replica_losses, axis=None
         )
 
+    def _train_n_steps(self, iterator, n):
+        """Run up to n training steps in one graph, return number of steps run."""
+        steps = tf.constant(0, dtype=tf.int32)
+        for _ in tf.range(n):
+            optional_batch = iterator.get_next_as_optional()
+            if not optional_batch.has_value():
+                break
+            self._one_step_forward(optional_batch.get_value())
+            steps += 1
+        return steps
+
+    def _get_steps_per_execution(self):
+        """Return number of steps to run before the next interval or finish."""
+        steps_per_execution = self.config.get("steps_per_execution", 1)
+        for key in ["log_interval_steps", "eval_interval_steps", "save_interval_steps"]:
+            interval = self.config[key]
+            steps_per_execution = min(
+                steps_per_execution, interval - self.steps % interval
+            )
+        steps_per_execution = min(
+            steps_per_execution, self.config["train_max_steps"] - self.steps
+        )
+        if self.steps < self.config["discriminator_train_start_steps"]:
+            steps_per_execution = min(
+                steps_per_execution,
+                self.config["discriminator_train_start_steps"] - self.steps,
+            )
+        return max(1, steps_per_execution)
+
+    def _train_epoch(self):
+        """Train model one epoch, running steps_per_execution steps per call."""
+        if self.config.get("steps_per_execution", 1) == 1:
+            return super()._train_epoch()
+
+        self._apply_input_signature()
+        iterator = iter(self.train_data_loader)
+        train_steps_per_epoch = 0
+        while True:
+            steps_per_execution = self._get_steps_per_execution()
+            steps = int(
+                self.train_n_steps(
+                    iterator, tf.constant(steps_per_execution, dtype=tf.int32)
+                )
+            )
+
+            if steps > 0:
+                # update counts
+                self.steps += steps
+                train_steps_per_epoch += steps
+                self.tqdm.update(steps)
+                self._check_train_finish()
+
+                # check interval
+                self._check_log_interval()
+                self._check_eval_interval()
+                self._check_save_interval()
+
+                # check wheter training is finished
+                if self.finish_train:
+                    return
+
+            # iterator is exhausted
+            if steps < steps_per_execution:
+                break
+
+        # update
+        self.epochs += 1
+        self.train_steps_per_epoch = train_steps_per_epoch
+        logging.info(
+            f"(Steps: {self.steps}) Finished {self.epochs} epoch training "
+            f"({self.train_steps_per_epoch} steps per epoch)."
+        )
+
     @abc.abstractmethod
     def compute_per_example_generator_losses(self, batch, outputs):
         """Compute per example generator losses and return dict_metrics_losses
@@ -376,17 +508,20 @@ class GanBasedTrainer(BasedTrainer):
         self.update_train_metrics(dict_metrics_losses)
 
         if self.config["gradient_accumulation_steps"] == 1:
-            return gradients, per_replica_gen_losses
+            return gradients, per_replica_gen_losses, outputs
         else:
             return per_replica_gen_losses
 
-    def _calculate_discriminator_gradient_per_batch(self, batch):
+    def _calculate_discriminator_gradient_per_batch(self, batch, gen_outputs=None):
+        # gen_outputs is the generator output of the same step. Gradients
+        # below are only taken w.r.t discriminator variables so it never
+        # back-propagates into the generator.
+        if gen_outputs is None:
+            gen_outputs = self._generator(**batch, training=True)
         (
             per_example_losses,
             dict_metrics_losses,
-        ) = self.compute_per_example_discriminator_losses(
-            batch, self._generator(**batch, training=True)
-        )
+        ) = self.compute_per_example_discriminator_losses(batch, gen_outputs)
 
         per_replica_dis_losses = tf.nn.compute_average_loss(
             per_example_losses,
@@ -424,18 +559,59 @@ class GanBasedTrainer(BasedTrainer):
             return per_replica_dis_losses
 
 
+    def _calculate_gradients_per_batch(self, batch):
+        """Calculate generator and discriminator gradients of one batch.
+
+        Discriminator is fed with y_hat of the generator step instead of running
+        the generator again, both gradients are computed before any update.
+        """
+        (
+            gen_gradients,
+            per_replica_gen_losses,
+            gen_outputs,
+        ) = self._calculate_generator_gradient_per_batch(batch)
+
+        if self.steps < self.config["discriminator_train_start_steps"]:
+            return gen_gradients, per_replica_gen_losses
+
+        (
+            dis_gradients,
+            per_replica_dis_losses,
+        ) = self._calculate_discriminator_gradient_per_batch(batch, gen_outputs)
+        return (
+            gen_gradients,
+            per_replica_gen_losses,
+            dis_gradients,
+            per_replica_dis_losses,
+        )
+
     def _one_step_forward_per_replica(self, batch):
         per_replica_gen_losses = 0.0
         per_replica_dis_losses = 0.0
 
         if self.config["gradient_accumulation_steps"] == 1:
-            (
-                gradients,
-                per_replica_gen_losses,
-            ) = self._calculate_generator_gradient_per_batch(batch)
+            # string features (utt_ids) are not used by losses and can not be
+            # compiled by XLA.
+            batch = {k: v for k, v in batch.items() if v.dtype != tf.string}
+            if self.steps >= self.config["discriminator_train_start_steps"]:
+                (
+                    gen_gradients,
+                    per_replica_gen_losses,
+                    dis_gradients,
+                    per_replica_dis_losses,
+                ) = self.calculate_gradients_per_batch(batch)
+                self._dis_optimizer.apply_gradients(
+                    zip(dis_gradients, self._discriminator.trainable_variables)
+                )
+            else:
+                (
+                    gen_gradients,
+                    per_replica_gen_losses,
+                ) = self.calculate_gradients_per_batch(batch)
             self._gen_optimizer.apply_gradients(
-                zip(gradients, self._generator.trainable_variables)
+                zip(gen_gradients, self._generator.trainable_variables)
             )
+            return per_replica_gen_losses + per_replica_dis_losses
         else:
             # gradient acummulation here.
             for i in tf.range(self.config["gradient_accumulation_steps"]):
@@ -465,39 +641,30 @@ class GanBasedTrainer(BasedTrainer):
         # one step discriminator
         # recompute y_hat after 1 step generator for discriminator training.
         if self.steps >= self.config["discriminator_train_start_steps"]:
-            if self.config["gradient_accumulation_steps"] == 1:
-                (
-                    gradients,
-                    per_replica_dis_losses,
-                ) = self._calculate_discriminator_gradient_per_batch(batch)
-                self._dis_optimizer.apply_gradients(
-                    zip(gradients, self._discriminator.trainable_variables)
-                )
-            else:
-                # gradient acummulation here.
-                for i in tf.range(self.config["gradient_accumulation_steps"]):
-                    reduced_batch = {
-                        k: v[
-                            i
-                            * self.config["batch_size"] : (i + 1)
-                            * self.config["batch_size"]
-                        ]
-                        for k, v in batch.items()
-                    }
-
-                    # run 1 step accumulate
-                    reduced_batch_losses = (
-                        self._calculate_discriminator_gradient_per_batch(reduced_batch)
-                    )
-
-                    # sum per_replica_losses
-                    per_replica_dis_losses += reduced_batch_losses
-
-                gradients = self._discriminator_gradient_accumulator.gradients
-                self._dis_optimizer.apply_gradients(
-                    zip(gradients, self._discriminator.trainable_variables)
+            # gradient acummulation here.
+            for i in tf.range(self.config["gradient_accumulation_steps"]):
+                reduced_batch = {
+                    k: v[
+                        i
+                        * self.config["batch_size"] : (i + 1)
+                        * self.config["batch_size"]
+                    ]
+                    for k, v in batch.items()
+                }
+
+                # run 1 step accumulate
+                reduced_batch_losses = self._calculate_discriminator_gradient_per_batch(
+                    reduced_batch
                 )
-                self._discriminator_gradient_accumulator.reset()
+
+                # sum per_replica_losses
+                per_replica_dis_losses += reduced_batch_losses
+
+            gradients = self._discriminator_gradient_accumulator.gradients
+            self._dis_optimizer.apply_gradients(
+                zip(gradients, self._discriminator.trainable_variables)
+            )
+            self._discriminator_gradient_accumulator.reset()
 
         return per_replica_gen_losses + per_replica_dis_losses
 
@@ -557,14 +724,16 @@ class GanBasedTrainer(BasedTrainer):
     ################################################
 
     def _one_step_evaluate(self, batch):
-        self._strategy.run(self._one_step_evaluate_per_replica, args=(batch,))
+        batch = {k: v for k, v in batch.items() if v.dtype != tf.string}
+        self._strategy.run(self.one_step_evaluate_per_replica, args=(batch,))
 
     def _one_step_predict_per_replica(self, batch):
         outputs = self._generator(**batch, training=False)
         return outputs
 
     def _one_step_predict(self, batch):
-        outputs = self._strategy.run(self._one_step_predict_per_replica, args=(batch,))
+        batch = {k: v for k, v in batch.items() if v.dtype != tf.string}
+        outputs = self._strategy.run(self.one_step_predict_per_replica, args=(batch,))
         return outputs
 
     @abc.abstractmethod
@@ -665,6 +834,9 @@ class GanBasedTrainer(BasedTrainer):
     def fit(self, train_data_loader, valid_data_loader, saved_path, resume=None):
         self.set_train_data_loader(train_data_loader)
         self.set_eval_data_loader(valid_data_loader)
+        # keep element spec of global batch for per-replica signatures.
+        self._train_element_spec = self.train_data_loader.element_spec
+        self._eval_element_spec = self.eval_data_loader.element_spec
         self.train_data_loader = self._strategy.experimental_distribute_dataset(
             self.train_data_loader
         )
@@ -783,7 +955,7 @@ class Seq2SeqBasedTrainer(BasedTrainer, metaclass=abc.ABCMeta):
 
         # update counts
         self.steps += 1
-        self.tqdm.update(1)
+        self._update_tqdm()
         self._check_train_finish()
 
     def _one_step_forward(self, batch):
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Minh Nguyen (@dathudeptrai)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(".")
+
+from examples.melgan.audio_mel_dataset import AudioMelDataset, AudioMelTFRecordDataset
+
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s",
+)
+
+
+@pytest.mark.parametrize("num_shards", [1, 2, 8])
+def test_audio_mel_tfrecord_round_trip(tmpdir, num_shards):
+    num_utts = 5
+    audios, mels = {}, {}
+    for i in range(num_utts):
+        utt_id = f"utt{i}"
+        audios[utt_id] = np.random.uniform(-1.0, 1.0, size=[256 * (i + 2)])
+        audios[utt_id] = audios[utt_id].astype(np.float32)
+        mels[utt_id] = np.random.normal(size=[i + 2, 80]).astype(np.float32)
+        np.save(os.path.join(tmpdir, f"{utt_id}-wave.npy"), audios[utt_id])
+        np.save(os.path.join(tmpdir, f"{utt_id}-norm-feats.npy"), mels[utt_id])
+
+    AudioMelDataset(
+        root_dir=str(tmpdir), audio_query="*-wave.npy", mel_query="*-norm-feats.npy"
+    ).to_tfrecord(str(tmpdir), prefix="audio-mel-norm", num_shards=num_shards)
+
+    dataset = AudioMelTFRecordDataset(root_dir=str(tmpdir), prefix="audio-mel-norm")
+    assert len(dataset.tfrecord_files) == min(num_shards, num_utts)
+    assert dataset.get_len_dataset() == num_utts
+
+    num_items = 0
+    for items in dataset.create(batch_size=1):
+        utt_id = items["utt_ids"][0].numpy().decode()
+        # int16 audio is restored within one quantization step.
+        np.testing.assert_allclose(
+            items["audios"][0].numpy(), audios[utt_id], atol=1.0 / 32767
+        )
+        np.testing.assert_array_equal(
+            items["mels"][0].numpy(), mels[utt_id].astype(np.float16)
+        )
+        assert items["audio_lengths"][0] == len(audios[utt_id])
+        assert items["mel_lengths"][0] == len(mels[utt_id])
+        num_items += 1
+    assert num_items == num_utts
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright 2020 Minh Nguyen (@dathudeptrai)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+
+import pytest
+import tensorflow as tf
+
+from tensorflow_tts.trainers import GanBasedTrainer
+from tensorflow_tts.utils import return_strategy
+
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s",
+)
+
+
+class StubGenerator(tf.keras.Model):
+    def __init__(self):
+        super().__init__()
+        self.dense = tf.keras.layers.Dense(1)
+
+    def call(self, mels, **kwargs):
+        return self.dense(mels)
+
+
+class StubDiscriminator(tf.keras.Model):
+    def __init__(self):
+        super().__init__()
+        self.dense = tf.keras.layers.Dense(1)
+
+    def call(self, x, **kwargs):
+        return self.dense(x)
+
+
+class StubTrainer(GanBasedTrainer):
+    """GAN trainer recording the steps at which intervals fire."""
+
+    def __init__(self, config, strategy):
+        super().__init__(steps=0, epochs=0, config=config, strategy=strategy)
+        self.list_metrics_name = ["gen_loss", "dis_loss"]
+        self.init_train_eval_metrics(self.list_metrics_name)
+        self.log_steps = []
+        self.eval_steps = []
+        self.save_steps = []
+        self.steps_per_executions = []
+
+    def compute_per_example_generator_losses(self, batch, outputs):
+        per_example_losses = tf.reduce_mean(tf.square(outputs), axis=[1, 2])
+        return per_example_losses, {"gen_loss": per_example_losses}
+
+    def compute_per_example_discriminator_losses(self, batch, gen_outputs):
+        p_hat = self._discriminator(gen_outputs)
+        per_example_losses = tf.reduce_mean(tf.square(p_hat), axis=[1, 2])
+        return per_example_losses, {"dis_loss": per_example_losses}
+
+    def generate_and_save_intermediate_result(self, batch):
+        pass
+
+    def _get_steps_per_execution(self):
+        steps_per_execution = super()._get_steps_per_execution()
+        self.steps_per_executions.append(steps_per_execution)
+        return steps_per_execution
+
+    def _write_to_tensorboard(self, list_metrics, stage="train"):
+        self.log_steps.append(self.steps)
+
+    def _eval_epoch(self):
+        self.eval_steps.append(self.steps)
+
+    def save_checkpoint(self):
+        self.save_steps.append(self.steps)
+
+
+def make_trainer_config(outdir, **kwargs):
+    defaults = dict(
+        outdir=outdir,
+        batch_size=2,
+        gradient_accumulation_steps=1,
+        train_max_steps=20,
+        discriminator_train_start_steps=0,
+        log_interval_steps=3,
+        eval_interval_steps=5,
+        save_interval_steps=6,
+        num_save_intermediate_results=1,
+        steps_per_execution=1,
+        use_xla=False,
+    )
+    defaults.update(kwargs)
+    return defaults
+
+
+def make_dataset(num_batches, batch_size=2):
+    return tf.data.Dataset.from_tensor_slices(
+        {
+            "mels": tf.random.normal([num_batches * batch_size, 4, 80]),
+            "audios": tf.random.normal([num_batches * batch_size, 16]),
+        }
+    ).batch(batch_size)
+
+
+def fit_stub_trainer(config, num_batches):
+    strategy = return_strategy()
+    with strategy.scope():
+        generator = StubGenerator()
+        discriminator = StubDiscriminator()
+        generator(tf.zeros([1, 4, 80]))
+        discriminator(tf.zeros([1, 4, 1]))
+        trainer = StubTrainer(config=config, strategy=strategy)
+        trainer.compile(
+            gen_model=generator,
+            dis_model=discriminator,
+            gen_optimizer=tf.keras.optimizers.Adam(),
+            dis_optimizer=tf.keras.optimizers.Adam(),
+        )
+    trainer.fit(
+        make_dataset(num_batches),
+        make_dataset(1),
+        saved_path=os.path.join(config["outdir"], "checkpoints"),
+        resume="",
+    )
+    return trainer
+
+
+@pytest.mark.parametrize("steps_per_execution", [1, 4])
+def test_gan_trainer_intervals(tmpdir, steps_per_execution):
+    # 7 batches per epoch is not a multiple of steps_per_execution.
+    config = make_trainer_config(str(tmpdir), steps_per_execution=steps_per_execution)
+    trainer = fit_stub_trainer(config, num_batches=7)
+
+    assert trainer.steps == 20
+    assert trainer.epochs == 2
+    assert trainer.train_steps_per_epoch == 7
+    assert trainer.log_steps == [3, 6, 9, 12, 15, 18]
+    assert trainer.eval_steps == [5, 10, 15, 20]
+    assert trainer.save_steps == [6, 12, 18]
+    if steps_per_execution > 1:
+        assert max(trainer.steps_per_executions) > 1
+
+
+@pytest.mark.parametrize("steps_per_execution", [1, 4])
+def test_gan_trainer_stops_at_discriminator_train_start_steps(
+    tmpdir, steps_per_execution
+):
+    config = make_trainer_config(
+        str(tmpdir),
+        discriminator_train_start_steps=8,
+        steps_per_execution=steps_per_execution,
+    )
+    trainer = fit_stub_trainer(config, num_batches=7)
+
+    assert trainer.steps == 8
+    assert trainer.epochs == 1
+    assert trainer.train_steps_per_epoch == 7
+    assert trainer.log_steps == [3, 6]
+    assert trainer.eval_steps == [5]
+    assert trainer.save_steps == [6]
+
+
+@pytest.mark.parametrize(
+    "steps, expected",
+    [(0, 3), (3, 2), (5, 1), (6, 2), (7, 1), (18, 2), (19, 1)],
+)
+def test_gan_trainer_get_steps_per_execution(tmpdir, steps, expected):
+    config = make_trainer_config(
+        str(tmpdir), discriminator_train_start_steps=8, steps_per_execution=4
+    )
+    trainer = StubTrainer(config=config, strategy=return_strategy())
+    trainer.steps = steps
+    assert trainer._get_steps_per_execution() == expected
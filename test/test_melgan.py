@@ -90,3 +90,21 @@ def test_melgan_trainable(dict_g, dict_d, dict_loss):
 
     generator = TFMelGANGenerator(args_g)
     discriminator = TFMelGANMultiScaleDiscriminator(args_d)
+
+
+def test_melgan_generator_mixed_precision():
+    policy = tf.keras.mixed_precision.experimental.global_policy()
+    tf.keras.mixed_precision.experimental.set_policy("mixed_float16")
+    try:
+        args_g = MelGANGeneratorConfig(**make_melgan_generator_args())
+        generator = TFMelGANGenerator(args_g)
+        mels = tf.random.uniform(shape=[2, 32, 80], dtype=tf.float32)
+        y_hat = generator(mels)
+    finally:
+        tf.keras.mixed_precision.experimental.set_policy(policy)
+
+    # variables stay float32, output layers are pinned to float32.
+    assert all(v.dtype == tf.float32 for v in generator.trainable_variables)
+    assert y_hat.dtype == tf.float32
+    assert y_hat.shape == [2, 32 * 256, 1]
+    assert bool(tf.reduce_all(tf.math.is_finite(y_hat)))